@@ -14,24 +14,35 @@ Amazon US - Beauty & Personal Care Best Sellers Top 100
   * OUT: 전일 1~70 → 오늘 OUT, 전일 순위 오름차순, 최대 5개
 - 파일명: 아마존US_뷰티_랭킹_YYYY-MM-DD.csv (KST)
 """
-import os, re, io, math, pytz, time, random, traceback
+import os, re, io, json, math, heapq, asyncio, threading, time, random, traceback
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
+from operator import itemgetter
 from typing import List, Dict, Optional
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
+from zoneinfo import ZoneInfo
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+import numpy as np
 import pandas as pd
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
 
 # ==================== 공통 유틸 ====================
-KST = pytz.timezone("Asia/Seoul")
+KST = ZoneInfo("Asia/Seoul")
 def now_kst(): return dt.datetime.now(KST)
-def today_kst_str(): return now_kst().strftime("%Y-%m-%d")
-def yesterday_kst_str(): return (now_kst() - dt.timedelta(days=1)).strftime("%Y-%m-%d")
+RUN_DATE_KST = now_kst().date()  # 하루 1회 실행 → 오늘/어제를 같은 시점 기준으로 고정
+def today_kst_str(): return RUN_DATE_KST.strftime("%Y-%m-%d")
+def yesterday_kst_str(): return (RUN_DATE_KST - dt.timedelta(days=1)).strftime("%Y-%m-%d")
 def build_filename(d): return f"아마존US_뷰티_랭킹_{d}.csv"
-def clean_text(s): return re.sub(r"\s+", " ", (s or "")).strip()
-def slack_escape(s): return s.replace("&","&amp;").replace("<","&lt;").replace(">","&gt;")
+WS_RE = re.compile(r"\s+")
+def clean_text(s): return WS_RE.sub(" ", (s or "")).strip()
+SLACK_ESCAPE_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+def slack_escape(s): return s.translate(SLACK_ESCAPE_TABLE)
 
 PAGE_CANDIDATES = [
     [  # page 1
@@ -59,15 +70,13 @@ ASIN_PCT      = re.compile(r"(?:dp%2F|asin%2F)([A-Z0-9]{10})")
 BY_BRAND_RE   = re.compile(r"\bby\s+([A-Za-z0-9&'’\-\.\s]{2,40})", re.I)
 BRAND_LABEL_RE= re.compile(r"\bBrand\s*[:\-]\s*([A-Za-z0-9&'’\-\.\s]{2,40})", re.I)
 VISIT_STORE_RE= re.compile(r"Visit the\s+(.+?)\s+Store", re.I)
+RANK_BADGE_RE = re.compile(r"#?\s*(\d{1,3})")
 
 def parse_usd_all(text: str) -> List[float]:
-    out=[]
-    for m in USD_RE.finditer(text or ""):
-        try:
-            v=float(m.group(1).replace(",",""))
-            if v>0: out.append(v)
-        except: pass
-    return out
+    if not text or "$" not in text: return []  # 가격 없는 블록은 정규식 스캔 생략
+    # 캡처 그룹은 숫자/콤마/점만 허용 → float 변환 실패 없음
+    vals = [float(v.replace(",","")) for v in USD_RE.findall(text)]
+    return [v for v in vals if v > 0]
 
 def fmt_currency_usd(v) -> str:
     try:
@@ -79,7 +88,7 @@ def discount_floor(orig: Optional[float], sale: Optional[float]) -> Optional[int
     if orig and sale and orig>0: return max(0,int(math.floor((1 - sale/orig)*100)))
     return None
 
-@dataclass
+@dataclass(slots=True)
 class Product:
     rank: Optional[int]
     brand: str
@@ -91,6 +100,22 @@ class Product:
     asin: str = ""
 
 # ==================== 공통 보조 ====================
+TEXT_XPATH  = etree.XPath(".//text()[not(parent::script or parent::style)]", smart_strings=False)
+
+def has_class(*names: str) -> str:
+    return " or ".join(f"contains(concat(' ', normalize-space(@class), ' '), ' {n} ')" for n in names)
+
+def node_text(node) -> str:
+    return clean_text(" ".join(TEXT_XPATH(node)))
+
+# 카드마다 반복 호출되는 하위 탐색은 미리 컴파일 (호출마다 XPath 문자열 재컴파일 방지)
+BADGE_XPATH       = etree.XPath(f".//*[{has_class('zg-badge-text', 'a-badge-text')}]")
+STORE_LINK_XPATH  = etree.XPath(".//a[contains(@href,'/stores/') and not(contains(@href,'/dp/'))]")
+LINK_NORMAL_XPATH = etree.XPath(f".//a[@href and ({has_class('a-link-normal')})]")
+TITLE_SPAN_XPATH  = etree.XPath(f".//span[{has_class('a-size-medium', 'a-size-base', 'p13n-sc-truncated')}]")
+IMG_ALT_XPATH     = etree.XPath("(.//img[@alt])[1]")
+ASIN_DESC_XPATH   = etree.XPath("(.//*[@data-asin])[1]")
+
 def canonical_amz_link(href: str, fallback_asin: str = "") -> str:
     if not href and fallback_asin:
         return f"https://www.amazon.com/dp/{fallback_asin}"
@@ -100,49 +125,41 @@ def canonical_amz_link(href: str, fallback_asin: str = "") -> str:
     return f"https://www.amazon.com/dp/{m.group(1)}" if m else (href or (f"https://www.amazon.com/dp/{fallback_asin}" if fallback_asin else ""))
 
 def extract_asin_from_node(node) -> str:
-    for target in (node, getattr(node, "parent", None), getattr(getattr(node, "parent", None), "parent", None)):
-        try:
-            v = target.get("data-asin")
-            if v: return v.strip()
-        except: pass
-    try:
-        d = node.select_one("[data-asin]")
-        if d:
-            v = d.get("data-asin")
-            if v: return v.strip()
-    except: pass
-    for a in node.select("a[href]"):
+    target = node
+    for _ in range(3):
+        if target is None: break
+        v = target.get("data-asin")
+        if v: return v.strip()
+        target = target.getparent()
+    d = ASIN_DESC_XPATH(node)
+    if d:
+        v = d[0].get("data-asin")
+        if v: return v.strip()
+    for a in node.iter("a"):
         h = a.get("href") or ""
         m = ASIN_IN_HREF.search(h) or ASIN_IN_QUERY.search(h) or ASIN_PCT.search(h)
         if m: return m.group(1)
     return ""
 
 def extract_rank_from_node(node) -> Optional[int]:
-    try:
-        v = node.get("aria-posinset")
-        if v and v.isdigit(): return int(v)
-    except: pass
-    try:
-        b = node.select_one(".zg-badge-text, .a-badge-text")
-        if b:
-            m = re.search(r"#?\s*(\d{1,3})", b.get_text(" ", strip=True))
-            if m: return int(m.group(1))
-    except: pass
-    try:
-        v = node.get("data-index")
-        if v and v.isdigit(): return int(v)+1
-    except: pass
+    v = node.get("aria-posinset")
+    if v and v.isdigit(): return int(v)
+    b = BADGE_XPATH(node)
+    if b:
+        m = RANK_BADGE_RE.search(node_text(b[0]))
+        if m: return int(m.group(1))
+    v = node.get("data-index")
+    if v and v.isdigit(): return int(v)+1
     return None
 
-def extract_brand_from_container(c, title_text: str) -> str:
-    for a in c.select("a[href*='/stores/']:not([href*='/dp/'])"):
-        t = clean_text(a.get_text(" ", strip=True))
+def extract_brand_from_container(c, title_text: str, block: str) -> str:
+    for a in STORE_LINK_XPATH(c):
+        t = node_text(a)
         if not t: continue
         m = VISIT_STORE_RE.search(t)
         if m: return clean_text(m.group(1))[:40]
         if t.lower() not in ("sponsored", "see more"):
             return t[:40]
-    block = clean_text(c.get_text(" ", strip=True))
     m = BRAND_LABEL_RE.search(block)
     if m:
         cand = clean_text(m.group(1))
@@ -158,63 +175,66 @@ def extract_brand_from_container(c, title_text: str) -> str:
     return guess[:40]
 
 # ==================== HTTP 파서 ====================
-def parse_http(html: str, page_idx: int) -> List[Product]:
-    soup = BeautifulSoup(html, "lxml")
-    selectors = [
-        "ol[id*='zg-ordered-list'] > li",
-        "[id*='gridItemRoot']",
-        "div.p13n-sc-uncoverable-faceout",
-        "div.zg-grid-general-faceout",
-        "[data-asin]"
-    ]
-    def uniq(nodes):
-        seen=set(); out=[]
-        for n in nodes:
-            if id(n) not in seen:
-                seen.add(id(n)); out.append(n)
-        return out
-
-    candidates=[]
-    for sel in selectors:
-        candidates += soup.select(sel)
-    candidates = uniq(candidates)
+# 카드 셀렉터 5종 (미리 컴파일, 셀렉터 우선순위대로 평가 → 순위 없는 카드의 extras 순서 유지)
+CARD_XPATHS = [etree.XPath(x) for x in (
+    "//ol[contains(@id,'zg-ordered-list')]/li",
+    "//*[contains(@id,'gridItemRoot')]",
+    f"//div[{has_class('p13n-sc-uncoverable-faceout')}]",
+    f"//div[{has_class('zg-grid-general-faceout')}]",
+    "//*[@data-asin]",
+)]
+DP_ANCHOR_XPATH = etree.XPath("//a[contains(@href,'/dp/')]")
+DP_IN_NODE_XPATH = etree.XPath(".//a[contains(@href,'/dp/')]")
+# 앵커 보강 시 카드 블록 후보 (우선순위: li → data-asin 조상 → div)
+ANCHOR_BLOCK_XPATHS = [etree.XPath(x) for x in ("ancestor::li[1]", "ancestor::*[@data-asin][1]", "ancestor::div[1]")]
+
+def parse_http_doc(doc, page_idx: int) -> List[Product]:
+    candidates = []; seen = set()
+    for xp in CARD_XPATHS:
+        for n in xp(doc):
+            if n not in seen:
+                seen.add(n); candidates.append(n)
 
     # 카드가 부족하면 앵커(/dp/) 기반 보강 (최대 70개 될 때까지)
     if len(candidates) < 60:
-        anchors = soup.select("a[href*='/dp/']")
-        for a in anchors:
-            blk = a.find_parent("li") or a.find_parent(attrs={"data-asin": True}) or a.find_parent("div") or a
-            candidates.append(blk)
-        candidates = uniq(candidates)
+        for a in DP_ANCHOR_XPATH(doc):
+            blk = next((b[0] for b in (xp(a) for xp in ANCHOR_BLOCK_XPATHS) if b), a)
+            if blk not in seen:
+                seen.add(blk); candidates.append(blk)
+
+    # ASIN 기준 버킷 (먼저 나온 카드 우선) → 셀렉터 여러 개에 걸린 같은 카드는 한 번만 처리
+    # ASIN은 data-asin/조상/?asin=/%2Fdp%2F 링크 어디서 나와도 인정, /dp/ 앵커 탐색은 채택된 카드에만
+    cards: Dict[str, tuple] = {}
+    for node in candidates:
+        asin = extract_asin_from_node(node)
+        if not asin or asin in cards: continue
+        dp = DP_IN_NODE_XPATH(node)
+        cards[asin] = (node, dp[0] if dp else None)
 
     by_rank: Dict[int, Product] = {}
-    seen_asin=set()
     extras=[]
 
-    for node in candidates:
+    for asin, (node, a) in cards.items():
         rank_in_page = extract_rank_from_node(node)
-        asin = extract_asin_from_node(node)
-        if not asin or asin in seen_asin: continue
 
-        a = node.select_one("a[href*='/dp/']") or node.select_one("a.a-link-normal[href]")
-        href = a.get("href") if a else ""
+        if a is None:
+            found = LINK_NORMAL_XPATH(node)
+            a = found[0] if found else None
+        href = a.get("href") if a is not None else ""
         link = canonical_amz_link(href or "", fallback_asin=asin)
 
         title = ""
-        if a: title = (a.get("aria-label") or a.get("title") or clean_text(a.get_text(" ", strip=True)) or "")
+        if a is not None: title = (a.get("aria-label") or a.get("title") or node_text(a) or "")
         if not title:
-            img = node.select_one("img[alt]")
-            if img and img.has_attr("alt"): title = clean_text(img["alt"])
+            img = IMG_ALT_XPATH(node)
+            if img: title = clean_text(img[0].get("alt"))
         if not title:
-            t = node.select_one("span.a-size-medium, span.a-size-base, span.p13n-sc-truncated")
-            if t: title = clean_text(t.get_text(" ", strip=True))
-        if not title: 
-            seen_asin.add(asin); 
-            continue
+            t = TITLE_SPAN_XPATH(node)
+            if t: title = node_text(t[0])
+        if not title: continue
 
-        brand = extract_brand_from_container(node, title)
-
-        block = clean_text(node.get_text(" ", strip=True))
+        block = node_text(node)
+        brand = extract_brand_from_container(node, title, block)
         prices = parse_usd_all(block)
         sale = orig = None
         if len(prices)==1: sale=prices[0]
@@ -230,217 +250,341 @@ def parse_http(html: str, page_idx: int) -> List[Product]:
         else:
             extras.append(p)
 
-        seen_asin.add(asin)
-
     out=[]
+    spare = iter(extras)
     for r in range(1, 50+1):
-        item = by_rank.get(r) or (extras.pop(0) if extras else None)
+        item = by_rank.get(r) or next(spare, None)
         if not item: continue
         item.rank = page_idx*50 + r
         out.append(item)
     return out
 
 # ==================== HTTP 수집 ====================
-def http_fetch_page(url: str, page_idx: int) -> List[Product]:
+class HttpSlots:
+    """동시 요청 상한 (with로 슬롯 점유) + 현재 스레드가 슬롯을 잡고 있는지 기록 → 백오프 중에만 잠시 양보"""
+    def __init__(self, n: int):
+        self._sem = threading.BoundedSemaphore(n)
+        self._local = threading.local()
+    def __enter__(self):
+        self._sem.acquire(); self._local.held = True
+        return self
+    def __exit__(self, *exc):
+        self._local.held = False; self._sem.release()
+    def release_if_held(self) -> bool:
+        if not getattr(self._local, "held", False): return False
+        self._local.held = False; self._sem.release()
+        return True
+    def reacquire(self):
+        self._sem.acquire(); self._local.held = True
+
+class CappedRetry(Retry):
+    """
+    Retry-After는 RETRY_AFTER_CAP초까지만 따르고, 더 길면 기다리지 않고 포기 (→ 다음 후보/Playwright)
+    slots가 주어지면 백오프 대기 중에는 (이 스레드가 잡고 있을 때만) 슬롯을 내려놓음 → 다른 페이지가 막히지 않게
+    """
+    RETRY_AFTER_CAP = 10.0
+    def __init__(self, *args, slots: Optional[HttpSlots] = None, **kw):
+        super().__init__(*args, **kw)
+        self.slots = slots
+    def new(self, **kw):
+        r = super().new(**kw)  # 재시도마다 새 인스턴스 → slots 전달
+        r.slots = self.slots
+        return r
+    def sleep(self, response=None):
+        wait = self.get_retry_after(response) if response is not None and self.respect_retry_after_header else None
+        if wait is not None and wait > self.RETRY_AFTER_CAP:
+            raise MaxRetryError(None, getattr(response, "url", None) or "",
+                                ResponseError(f"Retry-After {wait:.0f}s > {self.RETRY_AFTER_CAP:.0f}s"))
+        yielded = self.slots is not None and self.slots.release_if_held()
+        try: super().sleep(response)
+        finally:
+            if yielded: self.slots.reacquire()
+
+def build_http_session(slots: Optional[HttpSlots] = None) -> requests.Session:
     s = requests.Session()
     s.headers.update({
-        "User-Agent": random.choice(UA_POOL),
         "Accept-Language": "en-US,en;q=0.9,ko;q=0.6",
         "Cache-Control": "no-cache", "Pragma": "no-cache", "DNT": "1",
         "Upgrade-Insecure-Requests": "1",
     })
-    last_err=None
-    for attempt in range(3):
-        try:
-            r = s.get(url, timeout=25)
-            if r.status_code==429: raise requests.HTTPError("429 Too Many Requests")
+    # 재시도는 urllib3에 위임: 429/5xx·연결 오류 → 지수 백오프(+지터), 429는 Retry-After 우선
+    retry = CappedRetry(total=2, backoff_factor=1.2, backoff_jitter=0.3,
+                        status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"],
+                        respect_retry_after_header=True, slots=slots)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+    s.mount("https://", adapter)
+    return s
+
+# 페이지를 동시에 돌려도 amazon.com에 동시에 나가는 요청은 2개까지
+HTTP_SLOTS = HttpSlots(2)
+# keep-alive: 페이지/후보 URL/재시도 모두 같은 커넥션 풀을 재사용 (UA만 요청마다 교체)
+HTTP_SESSION = build_http_session(HTTP_SLOTS)
+HTTP_MIN_ITEMS = 96  # HTTP 결과를 채택하는 최소 개수 (미만이면 Playwright)
+# 끝난 페이지들의 부족분 합이 이 값을 넘으면 HTTP 결과 폐기 확정 (= 한 페이지라도 46개 미만, 예: 45개 한 장이면 포기)
+HTTP_MAX_MISSING = 100 - HTTP_MIN_ITEMS
+
+def read_html_stream(r: requests.Response):
+    """응답을 받는 대로 파서에 흘려 넣음 → 네트워크 대기 중에 트리 구성 (전체 문서 버퍼링 없음)"""
+    # 헤더에 charset이 있으면 그대로 사용, 없을 때만 libxml2 감지(meta charset)에 맡김
+    # (requests의 text/* 기본값 ISO-8859-1은 헤더에 charset이 명시된 경우가 아니므로 쓰지 않음)
+    enc = r.encoding if "charset=" in r.headers.get("Content-Type", "").lower() else None
+    parser = lxml.html.HTMLParser(collect_ids=False, encoding=enc)  # feed 상태가 파서에 붙으므로 요청마다 새로
+    for chunk in r.iter_content(16384):
+        parser.feed(chunk)
+    return parser.close()
+
+def http_fetch_page(url: str, page_idx: int, session: requests.Session = HTTP_SESSION,
+                    stop: Optional[threading.Event] = None) -> List[Product]:
+    # 재시도/백오프는 세션 어댑터(CappedRetry)가 처리 → 여기서는 한 번만 요청
+    # stop이 켜졌으면 슬롯 대기 전/요청 직전에 포기 (이미 폐기 확정된 수집이 요청을 보내지 않게)
+    if stop is not None and stop.is_set(): return []
+    with HTTP_SLOTS:
+        if stop is not None and stop.is_set(): return []
+        with session.get(url, headers={"User-Agent": random.choice(UA_POOL)}, timeout=25, stream=True) as r:
             r.raise_for_status()
-            return parse_http(r.text, page_idx)
-        except Exception as e:
-            last_err=e; time.sleep(1.2*(attempt+1))
-    if last_err: raise last_err
-    return []
+            return parse_http_doc(read_html_stream(r), page_idx)
+
+def fetch_candidates_http(urls: List[str], page_idx: int, delay: float = 0.0,
+                          stop: Optional[threading.Event] = None) -> List[Product]:
+    """후보 URL을 하나씩 시도 → 48개 이상이면 바로 채택, 나머지 후보는 요청하지 않음 (없으면 가장 많이 나온 결과)"""
+    stop = stop or threading.Event()
+    if delay and stop.wait(delay): return []
+    best: List[Product] = []
+    for u in urls:
+        if stop.is_set(): break
+        try: got = http_fetch_page(u, page_idx, stop=stop)
+        except Exception: continue
+        if len(got) > len(best): best = got
+        if len(best) >= 48: break
+    return best
 
 def fetch_by_http() -> List[Product]:
-    all_items: List[Product] = []
-    for page_idx, urls in enumerate(PAGE_CANDIDATES):
-        got=[]
-        for u in urls:
-            try:
-                got = http_fetch_page(u, page_idx)
-                if len(got) >= 48: break
-            except Exception:
-                continue
-        all_items.extend(got)
-        time.sleep(random.uniform(0.6,1.2))
-    return all_items
+    # 페이지끼리 독립 → 동시에 받아 대기시간을 max(t1,t2)로 (결과는 페이지 순서대로 이어붙임)
+    # 뒤 페이지는 0.6~1.2초 지터를 두고 시작 (페이지 간 요청 간격 유지)
+    # 먼저 끝난 페이지가 크게 부족하면 HTTP 결과는 어차피 폐기 → 나머지 페이지에 stop을 걸고 바로 Playwright로
+    pages: List[List[Product]] = [[] for _ in PAGE_CANDIDATES]
+    stop = threading.Event()
+    ex = ThreadPoolExecutor(max_workers=len(PAGE_CANDIDATES))
+    futs = {ex.submit(fetch_candidates_http, urls, page_idx, page_idx * random.uniform(0.6, 1.2), stop): page_idx
+            for page_idx, urls in enumerate(PAGE_CANDIDATES)}
+    missing = 0
+    try:
+        for f in as_completed(futs):
+            got = pages[futs[f]] = f.result()
+            missing += 50 - len(got)
+            if missing > HTTP_MAX_MISSING:
+                print(f"[HTTP] page{futs[f]+1} {len(got)}개 → 남은 페이지 대기 생략")
+                break
+    finally:
+        stop.set()  # 남은 페이지 스레드는 다음 후보/요청 전에 멈춤 (Playwright와 동시에 amazon.com을 두드리지 않게)
+        ex.shutdown(wait=False, cancel_futures=True)
+    return [item for got in pages for item in got]
 
 # ==================== Playwright 수집 ====================
-def fetch_page_playwright(url: str, page_idx: int) -> List[Product]:
-    """
-    Playwright 수집 (페이지별 50개)
-    - 기본: 후보 URL → 스크롤(강화) → JS 추출
-    - page_idx==0 부족: reload 재시도
-    - page_idx==1 부족: 1페이지 → Next 클릭 → 실패 시 href 직접 이동
-    """
-    from playwright.sync_api import sync_playwright
-
-    js = """
-    (pageIdx) => {
-      function text(el){ return (el && (el.innerText||'').replace(/\\s+/g,' ').trim()) || ''; }
-      const sels = [
-        "ol[id*='zg-ordered-list'] > li",
-        "[id*='gridItemRoot']",
-        "div.p13n-sc-uncoverable-faceout",
-        "div.zg-grid-general-faceout",
-        "[data-asin]"
-      ];
-      function uniq(nodes){ const s=new Set(), out=[]; nodes.forEach(n=>{ if(!s.has(n)){s.add(n); out.push(n);} }); return out; }
-      function canonical(href, asin){
-        if(!href && asin) return 'https://www.amazon.com/dp/'+asin;
-        if(href && href.startsWith('/')) href='https://www.amazon.com'+href;
-        const m = href && href.match(/\\/dp\\/([A-Z0-9]{10})/);
-        return m ? ('https://www.amazon.com/dp/'+m[1]) : (href || (asin? 'https://www.amazon.com/dp/'+asin : ''));
-      }
-      function extractASIN(node){
-        const g=n=>n&&n.getAttribute&&n.getAttribute('data-asin');
-        const d=g(node) || (node.querySelector&&g(node.querySelector('[data-asin]')));
-        if(d) return d.trim();
-        let p=node.parentElement;
-        for(let i=0;i<2 && p;i++){ const v=g(p); if(v) return v.trim(); p=p.parentElement; }
-        const links=node.querySelectorAll? node.querySelectorAll('a[href]'):[];
-        for(const l of links){
-          const h=l.getAttribute('href')||'';
-          let m=h.match(/\\/dp\\/([A-Z0-9]{10})/)||h.match(/[?&](?:pd_rd_i|asin|ASIN|m)=([A-Z0-9]{10})/)||h.match(/(?:dp%2F|asin%2F)([A-Z0-9]{10})/);
-          if(m) return m[1];
-        }
-        return '';
-      }
-      function extractRank(node){
-        let v = node.getAttribute && node.getAttribute('aria-posinset');
-        if(v && /^\\d+$/.test(v)) return parseInt(v,10);
-        const b = node.querySelector('.zg-badge-text, .a-badge-text');
-        if(b){ const m = text(b).match(/#?\\s*(\\d{1,3})/); if(m) return parseInt(m[1],10); }
-        v = node.getAttribute && node.getAttribute('data-index');
-        if(v && /^\\d+$/.test(v)) return parseInt(v,10)+1;
-        return null;
-      }
-      const usdRe=/(?:US\\$|\\$)\\s*([\\d]{1,3}(?:,\\d{3})*(?:\\.\\d{2})|[\\d]+(?:\\.\\d{2})?)/g;
-      const byBrandRe=/\\bby\\s+([A-Za-z0-9&'’\\-\\.\\s]{2,40})/i;
-      const brandLabel=/\\bBrand\\s*[:\\-]\\s*([A-Za-z0-9&'’\\-\\.\\s]{2,40})/i;
-      const visitStore=/Visit the\\s+(.+?)\\s+Store/i;
-
-      let cards=[]; for(const s of sels){ cards = cards.concat(Array.from(document.querySelectorAll(s))); }
-      if(cards.length < 60){
-        const anchors = Array.from(document.querySelectorAll("a[href*='/dp/']"));
-        for(const el of anchors){ cards.push(el.closest('li')||el.closest('[data-asin]')||el.closest('div')||el); }
-      }
-      cards = uniq(cards);
-
-      const map = new Map(); // rank_in_page -> product
-      const extras = [];
-      const seen = new Set();
-
-      for(const c of cards){
-        const asin = extractASIN(c);
-        if(!asin || seen.has(asin)) continue;
-        const rank = extractRank(c);
-
-        const a = c.querySelector("a[href*='/dp/']") || c.querySelector("a.a-link-normal[href]");
-        let title = a ? (a.getAttribute('aria-label') || a.getAttribute('title') || text(a)) : '';
-        if(!title){
-          const img=c.querySelector('img[alt]');
-          if(img) title=(img.getAttribute('alt')||'').replace(/\\s+/g,' ').trim();
-        }
-        if(!title){
-          const t=c.querySelector('span.a-size-medium, span.a-size-base, span.p13n-sc-truncated');
-          if(t) title=text(t);
-        }
-        if(!title) continue;
-
-        // brand
-        let brand='';
-        const storeA = c.querySelector("a[href*='/stores/']:not([href*='/dp/'])");
-        if(storeA){
-          const bt=text(storeA);
-          const m=bt.match(visitStore);
-          brand = m? m[1].trim() : (!/^(sponsored|see more)$/i.test(bt) ? bt.trim() : '');
-        }
-        if(!brand){
-          const blk=text(c);
-          let m=blk.match(brandLabel);
-          if(m) brand=(m[1]||'').trim();
-          else { m=blk.match(byBrandRe); if(m) brand=(m[1]||'').trim(); }
-        }
-        if(!brand){
-          const ws=title.split(' ');
-          if(ws.length){
-            brand=(ws[0].length<=3 && ws[1]) ? (ws[0]+' '+ws[1]) : ws[0];
-          }
-        }
-
-        const blk=text(c);
-        const prices = Array.from(blk.matchAll(usdRe))
-          .map(m => parseFloat(m[1].replace(/,/g,'')))
-          .filter(v => !isNaN(v) && v > 0);
-        let sale=null, orig=null;
-        if(prices.length===1) sale=prices[0];
-        else if(prices.length>=2){
-          sale=Math.min(...prices); orig=Math.max(...prices);
-          if(sale===orig) orig=null;
-        }
-
-        const row = {rank:null, brand, title, price:sale, orig_price:orig, url: canonical(a ? a.getAttribute('href') : '', asin), asin};
-
-        if(rank && rank>=1 && rank<=50 && !map.has(rank)) map.set(rank, row); else extras.push(row);
-        seen.add(asin);
+# 페이지 내 추출 함수: init script로 window.__extractBS에 한 번 심어두고 짧은 호출만 보냄
+JS_EXTRACTOR = """
+(pageIdx) => {
+  // 정규식은 한 번만 만들어 두고 카드/링크 루프에서 재사용
+  const wsRe=/\\s+/g, commaRe=/,/g, digitsRe=/^\\d+$/, badgeRe=/#?\\s*(\\d{1,3})/;
+  const dpRe=/\\/dp\\/([A-Z0-9]{10})/, qAsinRe=/[?&](?:pd_rd_i|asin|ASIN|m)=([A-Z0-9]{10})/, pctAsinRe=/(?:dp%2F|asin%2F)([A-Z0-9]{10})/;
+  const skipStoreRe=/^(sponsored|see more)$/i;
+  function text(el){ return (el && (el.innerText||'').replace(wsRe,' ').trim()) || ''; }
+  const sels = [
+    "ol[id*='zg-ordered-list'] > li",
+    "[id*='gridItemRoot']",
+    "div.p13n-sc-uncoverable-faceout",
+    "div.zg-grid-general-faceout",
+    "[data-asin]"
+  ];
+  function uniq(nodes){ const s=new Set(), out=[]; nodes.forEach(n=>{ if(!s.has(n)){s.add(n); out.push(n);} }); return out; }
+  function canonical(href, asin){
+    if(!href && asin) return 'https://www.amazon.com/dp/'+asin;
+    if(href && href.startsWith('/')) href='https://www.amazon.com'+href;
+    const m = href && href.match(dpRe);
+    return m ? ('https://www.amazon.com/dp/'+m[1]) : (href || (asin? 'https://www.amazon.com/dp/'+asin : ''));
+  }
+  function extractASIN(node){
+    const g=n=>n&&n.getAttribute&&n.getAttribute('data-asin');
+    const d=g(node) || (node.querySelector&&g(node.querySelector('[data-asin]')));
+    if(d) return d.trim();
+    let p=node.parentElement;
+    for(let i=0;i<2 && p;i++){ const v=g(p); if(v) return v.trim(); p=p.parentElement; }
+    const links=node.querySelectorAll? node.querySelectorAll('a[href]'):[];
+    for(const l of links){
+      const h=l.getAttribute('href')||'';
+      let m=h.match(dpRe)||h.match(qAsinRe)||h.match(pctAsinRe);
+      if(m) return m[1];
+    }
+    return '';
+  }
+  function extractRank(node){
+    let v = node.getAttribute && node.getAttribute('aria-posinset');
+    if(v && digitsRe.test(v)) return parseInt(v,10);
+    const b = node.querySelector('.zg-badge-text, .a-badge-text');
+    if(b){ const m = text(b).match(badgeRe); if(m) return parseInt(m[1],10); }
+    v = node.getAttribute && node.getAttribute('data-index');
+    if(v && digitsRe.test(v)) return parseInt(v,10)+1;
+    return null;
+  }
+  const usdRe=/(?:US\\$|\\$)\\s*([\\d]{1,3}(?:,\\d{3})*(?:\\.\\d{2})|[\\d]+(?:\\.\\d{2})?)/g;
+  const byBrandRe=/\\bby\\s+([A-Za-z0-9&'’\\-\\.\\s]{2,40})/i;
+  const brandLabel=/\\bBrand\\s*[:\\-]\\s*([A-Za-z0-9&'’\\-\\.\\s]{2,40})/i;
+  const visitStore=/Visit the\\s+(.+?)\\s+Store/i;
+
+  let cards=[]; for(const s of sels){ cards = cards.concat(Array.from(document.querySelectorAll(s))); }
+  if(cards.length < 60){
+    const anchors = Array.from(document.querySelectorAll("a[href*='/dp/']"));
+    for(const el of anchors){ cards.push(el.closest('li')||el.closest('[data-asin]')||el.closest('div')||el); }
+  }
+  cards = uniq(cards);
+
+  const map = new Map(); // rank_in_page -> product
+  const extras = [];
+  const seen = new Set();
+
+  for(const c of cards){
+    const asin = extractASIN(c);
+    if(!asin || seen.has(asin)) continue;
+    const rank = extractRank(c);
+
+    const a = c.querySelector("a[href*='/dp/']") || c.querySelector("a.a-link-normal[href]");
+    let title = a ? (a.getAttribute('aria-label') || a.getAttribute('title') || text(a)) : '';
+    if(!title){
+      const img=c.querySelector('img[alt]');
+      if(img) title=(img.getAttribute('alt')||'').replace(wsRe,' ').trim();
+    }
+    if(!title){
+      const t=c.querySelector('span.a-size-medium, span.a-size-base, span.p13n-sc-truncated');
+      if(t) title=text(t);
+    }
+    if(!title) continue;
+
+    // brand
+    let brand='';
+    const storeA = c.querySelector("a[href*='/stores/']:not([href*='/dp/'])");
+    if(storeA){
+      const bt=text(storeA);
+      const m=bt.match(visitStore);
+      brand = m? m[1].trim() : (!skipStoreRe.test(bt) ? bt.trim() : '');
+    }
+    const blk=text(c);  // innerText는 레이아웃을 타므로 카드당 한 번만
+    if(!brand){
+      let m=blk.match(brandLabel);
+      if(m) brand=(m[1]||'').trim();
+      else { m=blk.match(byBrandRe); if(m) brand=(m[1]||'').trim(); }
+    }
+    if(!brand){
+      const ws=title.split(' ');
+      if(ws.length){
+        brand=(ws[0].length<=3 && ws[1]) ? (ws[0]+' '+ws[1]) : ws[0];
       }
+    }
 
-      const out=[];
-      for(let r=1;r<=50;r++){
-        let row = map.get(r) || extras.shift();
-        if(!row) continue;
-        row.rank = pageIdx*50 + r;
-        out.push(row);
-      }
-      return out;
+    const prices = Array.from(blk.matchAll(usdRe))
+      .map(m => parseFloat(m[1].replace(commaRe,'')))
+      .filter(v => !isNaN(v) && v > 0);
+    let sale=null, orig=null;
+    if(prices.length===1) sale=prices[0];
+    else if(prices.length>=2){
+      sale=Math.min(...prices); orig=Math.max(...prices);
+      if(sale===orig) orig=null;
     }
-    """
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(
-            headless=True,
-            args=["--no-sandbox","--disable-dev-shm-usage","--disable-blink-features=AutomationControlled"],
-        )
-        ctx = browser.new_context(
-            viewport={"width":1366,"height":900},
-            locale="en-US",
-            timezone_id="America/Los_Angeles",
-            user_agent=random.choice(UA_POOL),
-            extra_http_headers={"Accept-Language":"en-US,en;q=0.9,ko;q=0.6"},
-        )
-        ctx.add_init_script("Object.defineProperty(navigator,'webdriver',{get:()=>undefined});")
-        page = ctx.new_page()
+    const row = {rank:null, brand, title, price:sale, orig_price:orig, url: canonical(a ? a.getAttribute('href') : '', asin), asin};
+
+    if(rank && rank>=1 && rank<=50 && !map.has(rank)) map.set(rank, row); else extras.push(row);
+    seen.add(asin);
+  }
+
+  const out=[];
+  for(let r=1;r<=50;r++){
+    let row = map.get(r) || extras.shift();
+    if(!row) continue;
+    row.rank = pageIdx*50 + r;
+    out.push(row);
+  }
+  return out;
+}
+"""
+JS_EXTRACT_CALL = "(pi) => window.__extractBS(pi)"
+CARD_COUNT_SEL = "[id*='gridItemRoot'], ol[id*='zg-ordered-list'] > li"
+CARD_COUNT_JS = f"(n) => document.querySelectorAll({json.dumps(CARD_COUNT_SEL)}).length >= n"
+
+# DOM 텍스트만 읽으므로 이미지/폰트/트래커는 받지 않음 (document/script/xhr/fetch는 유지)
+# CSS는 유지: 추출기의 innerText는 레이아웃 기준이라 CSS가 없으면 숨김 요소 텍스트가 브랜드/가격에 섞임
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+BLOCKED_HOST_RE = re.compile(r"doubleclick|googletagmanager|amazon-adsystem|scorecardresearch")
+
+async def block_heavy_route(route):
+    req = route.request
+    if req.resource_type in BLOCKED_RESOURCE_TYPES or BLOCKED_HOST_RE.search(urlparse(req.url).netloc):
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def new_pw_context(browser):
+    ctx = await browser.new_context(
+        viewport={"width":1366,"height":900},
+        locale="en-US",
+        timezone_id="America/Los_Angeles",
+        user_agent=random.choice(UA_POOL),
+        extra_http_headers={"Accept-Language":"en-US,en;q=0.9,ko;q=0.6"},
+    )
+    await ctx.add_init_script("Object.defineProperty(navigator,'webdriver',{get:()=>undefined});")
+    await ctx.add_init_script(f"window.__extractBS = {JS_EXTRACTOR};")
+    await ctx.route("**/*", block_heavy_route)
+    return ctx
+
+# 스크롤 루프를 페이지 안에서 돌림 → 스크롤/대기 1회당 왕복하던 IPC를 호출 1번으로
+# want>0이면 카드 수가 want 이상에서 한 틱 동안 그대로일 때 조기 종료 (시작 시점 카드 수부터 비교)
+SCROLL_JS = """async ([n, dy, ms, want]) => {
+  const count = () => document.querySelectorAll(%s).length;
+  let last = want ? count() : -1;
+  for (let i = 0; i < n; i++) {
+    window.scrollBy(0, dy); await new Promise(r => setTimeout(r, ms));
+    if (want) { const c = count(); if (c === last && c >= want) break; last = c; }
+  }
+}""" % json.dumps(CARD_COUNT_SEL)
+
+async def scroll_burst(page, times: int, step: int, pause_ms: int, until_stable: int = 0):
+    try: await page.evaluate(SCROLL_JS, [times, step, pause_ms, until_stable])
+    except: pass
 
+async def wait_for_cards(page, n: int = 1, timeout: int = 5_000):
+    """networkidle 대신 카드가 DOM에 나타나는 시점까지만 대기 (광고/비콘 때문에 idle은 거의 안 옴)"""
+    try: await page.wait_for_function(CARD_COUNT_JS, arg=n, timeout=timeout)
+    except: pass
+
+async def scroll_until_cards(page, rounds: int, step: int, pause_ms: int):
+    """짧게 스크롤 후 기존 강화 스크롤을 이어가며 매 틱 카드 수 확인 → 48개 이상에서 멈추면 바로 종료
+    (스크롤 없이 기다리는 구간이 없으므로 최악에도 기존 고정 스크롤 + 1.2초)"""
+    await scroll_burst(page, 8, 2400, 150)
+    await scroll_burst(page, rounds, step, pause_ms, until_stable=48)
+
+async def fetch_page_playwright(ctx, url: str, page_idx: int) -> List[Product]:
+    """
+    Playwright 수집 (페이지별 50개, 모든 페이지/후보 URL이 같은 context의 탭)
+    - 기본: 후보 URL → 스크롤(강화) → JS 추출
+    - page_idx==0 부족: reload 재시도
+    - page_idx==1 부족: 1페이지 → Next 클릭 → 실패 시 href 직접 이동
+    """
+    page = await ctx.new_page()
+    try:
         # 1) 후보 URL로 진입
-        page.goto(url, wait_until="domcontentloaded", timeout=60_000)
-        try: page.wait_for_load_state("networkidle", timeout=30_000)
-        except: pass
+        await page.goto(url, wait_until="domcontentloaded", timeout=60_000)
+        await wait_for_cards(page)
 
         # 쿠키 배너 닫기
         for sel in ["#sp-cc-accept","button[name='accept']","input#sp-cc-accept","button:has-text('Accept')"]:
-            try: page.locator(sel).first.click(timeout=1200)
+            try: await page.locator(sel).first.click(timeout=1200)
             except: pass
 
-        # 스크롤 (강화)
-        for _ in range(32):
-            try: page.mouse.wheel(0, 1600)
-            except: pass
-            page.wait_for_timeout(650)
+        # 스크롤 (카드 수 조건 대기, 부족하면 강화 스크롤)
+        await scroll_until_cards(page, rounds=32, step=1600, pause_ms=650)
 
         # 1차 평가
         try:
-            data = page.evaluate(js, page_idx)
+            data = await page.evaluate(JS_EXTRACT_CALL, page_idx)
         except Exception as e:
             print("[Playwright] evaluate 1st try failed:", e)
             data = []
@@ -448,14 +592,10 @@ def fetch_page_playwright(url: str, page_idx: int) -> List[Product]:
         # page1 부족 → reload 재시도
         if page_idx == 0 and (not isinstance(data, list) or len(data) < 45):
             try:
-                page.reload(wait_until="domcontentloaded", timeout=60_000)
-                try: page.wait_for_load_state("networkidle", timeout=20_000)
-                except: pass
-                for _ in range(22):
-                    try: page.mouse.wheel(0, 1600)
-                    except: pass
-                    page.wait_for_timeout(500)
-                data = page.evaluate(js, page_idx)
+                await page.reload(wait_until="domcontentloaded", timeout=60_000)
+                await wait_for_cards(page)
+                await scroll_until_cards(page, rounds=22, step=1600, pause_ms=500)
+                data = await page.evaluate(JS_EXTRACT_CALL, page_idx)
             except Exception as e:
                 print("[Playwright] page1 reload fallback failed:", e)
 
@@ -463,16 +603,12 @@ def fetch_page_playwright(url: str, page_idx: int) -> List[Product]:
         if page_idx == 1 and (not isinstance(data, list) or len(data) < 45):
             try:
                 print("[Playwright] page2 부족 → Next-click / href-goto fallback")
-                page.goto(PAGE_CANDIDATES[0][0], wait_until="domcontentloaded", timeout=60_000)
-                try: page.wait_for_load_state("networkidle", timeout=20_000)
-                except: pass
+                await page.goto(PAGE_CANDIDATES[0][0], wait_until="domcontentloaded", timeout=60_000)
+                await wait_for_cards(page)
                 for sel in ["#sp-cc-accept","button[name='accept']","input#sp-cc-accept","button:has-text('Accept')"]:
-                    try: page.locator(sel).first.click(timeout=1200)
+                    try: await page.locator(sel).first.click(timeout=1200)
                     except: pass
-                for _ in range(8):
-                    try: page.mouse.wheel(0, 1400)
-                    except: pass
-                    page.wait_for_timeout(250)
+                await scroll_burst(page, 8, 1400, 250)
 
                 clicked=False
                 for sel in [
@@ -481,13 +617,13 @@ def fetch_page_playwright(url: str, page_idx: int) -> List[Product]:
                     "a[aria-label='Go to next page']","li.a-last a","a.s-pagination-next"
                 ]:
                     try:
-                        page.locator(sel).first.click(timeout=4000, force=True)
+                        await page.locator(sel).first.click(timeout=4000, force=True)
                         clicked=True; break
                     except: pass
 
                 if not clicked:
                     try:
-                        page2_href = page.evaluate("""
+                        page2_href = await page.evaluate("""
                         () => {
                           const toAbs = (h) => h && (h.startsWith('/') ? 'https://www.amazon.com'+h : h);
                           const as = Array.from(document.querySelectorAll('a[href]'));
@@ -498,27 +634,20 @@ def fetch_page_playwright(url: str, page_idx: int) -> List[Product]:
                         }
                         """)
                         if page2_href:
-                            page.goto(page2_href, wait_until="domcontentloaded", timeout=60_000)
-                            try: page.wait_for_load_state("networkidle", timeout=20_000)
-                            except: pass
+                            await page.goto(page2_href, wait_until="domcontentloaded", timeout=60_000)
+                            await wait_for_cards(page)
                             clicked=True
                     except Exception as e:
                         print("[Playwright] href-goto fallback failed:", e)
 
                 if clicked:
-                    for _ in range(28):
-                        try: page.mouse.wheel(0, 1600)
-                        except: pass
-                        page.wait_for_timeout(500)
+                    await scroll_until_cards(page, rounds=28, step=1600, pause_ms=500)
                     try:
-                        data = page.evaluate(js, page_idx)
+                        data = await page.evaluate(JS_EXTRACT_CALL, page_idx)
                         if len(data) < 45:
-                            page.wait_for_timeout(1500)
-                            for _ in range(6):
-                                try: page.mouse.wheel(0, 1800)
-                                except: pass
-                                page.wait_for_timeout(400)
-                            data = page.evaluate(js, page_idx)
+                            await page.wait_for_timeout(1500)
+                            await scroll_burst(page, 6, 1800, 400)
+                            data = await page.evaluate(JS_EXTRACT_CALL, page_idx)
                     except Exception as e:
                         print("[Playwright] evaluate after goto/next failed:", e)
                         data = []
@@ -526,8 +655,8 @@ def fetch_page_playwright(url: str, page_idx: int) -> List[Product]:
                     print("[Playwright] Next 클릭/이동 폴백 모두 실패")
             except Exception as e:
                 print("[Playwright] page2 fallback block failed:", e)
-
-        ctx.close(); browser.close()
+    finally:
+        await page.close()
 
     out=[]
     for r in (data or []):
@@ -543,40 +672,55 @@ def fetch_page_playwright(url: str, page_idx: int) -> List[Product]:
         ))
     return out
 
+async def fetch_candidates_playwright(ctx, urls: List[str], page_idx: int) -> List[Product]:
+    got=[]
+    for u in urls:
+        got = await fetch_page_playwright(ctx, u, page_idx)
+        if len(got) >= 48: break
+    return got
+
+async def fetch_by_playwright_async() -> List[Product]:
+    """브라우저 1개 + context 1개에서 페이지 탭 2개를 동시에 진행"""
+    from playwright.async_api import async_playwright
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(
+            headless=True,
+            args=["--no-sandbox","--disable-dev-shm-usage","--disable-blink-features=AutomationControlled"],
+        )
+        try:
+            ctx = await new_pw_context(browser)
+            pages = await asyncio.gather(*(
+                fetch_candidates_playwright(ctx, urls, page_idx)
+                for page_idx, urls in enumerate(PAGE_CANDIDATES)
+            ))
+        finally:
+            await browser.close()
+    return [item for got in pages for item in got]
+
 def fetch_by_playwright() -> List[Product]:
-    all_items=[]
-    for page_idx, urls in enumerate(PAGE_CANDIDATES):
-        got=[]
-        for u in urls:
-            got = fetch_page_playwright(u, page_idx)
-            if len(got) >= 48: break
-        all_items.extend(got)
-        time.sleep(0.7)
-    return all_items
+    return asyncio.run(fetch_by_playwright_async())
 
 # ==================== 통합 수집/병합 ====================
 def merge_by_rank(*lists: List[Product]) -> List[Product]:
+    # 뒤 리스트가 같은 순위를 덮어씀 (key가 곧 rank라 재할당 불필요)
     by_rank: Dict[int, Product] = {}
     for L in lists:
         for p in (L or []):
             if p.rank: by_rank[p.rank] = p
-    out=[]
-    for r in range(1, 101):
-        if r in by_rank:
-            p = by_rank[r]; p.rank = r; out.append(p)
-    return out
+    return [by_rank[r] for r in range(1, 101) if r in by_rank]
 
 def fetch_products() -> List[Product]:
     # 1) HTTP
     try:
         items_http = fetch_by_http()
-        items = items_http if len(items_http) >= 96 else []
+        items = items_http if len(items_http) >= HTTP_MIN_ITEMS else []
         if not items: raise RuntimeError("HTTP 수집 부족")
     except Exception as e:
         print("[HTTP 오류] → Playwright 폴백:", e); items=[]
 
     # 2) Playwright 보강
-    if len(items) < 96:
+    if len(items) < HTTP_MIN_ITEMS:
         items_pw = fetch_by_playwright()
         items = merge_by_rank(items, items_pw)
 
@@ -603,54 +747,75 @@ def build_drive_service():
     if not (cid and csec and rtk): raise RuntimeError("OAuth 자격정보가 없습니다. GOOGLE_* 확인")
     creds = Credentials(None, refresh_token=rtk, token_uri="https://oauth2.googleapis.com/token",
                         client_id=cid, client_secret=csec)
-    svc = build("drive","v3",credentials=creds, cache_discovery=False)
-    try:
-        about=svc.about().get(fields="user(displayName,emailAddress)").execute()
-        u=about.get("user",{}); print(f"[Drive] user={u.get('displayName')} <{u.get('emailAddress')}>")
-    except Exception as e:
-        print("[Drive] whoami 실패:", e)
-    return svc
-
-def drive_upload_csv(service, folder_id: str, name: str, df: pd.DataFrame) -> str:
-    from googleapiclient.http import MediaIoBaseUpload
-    q=f"name='{name}' and '{folder_id}' in parents and trashed=false"
-    res=service.files().list(q=q, fields="files(id,name)", supportsAllDrives=True, includeItemsFromAllDrives=True).execute()
-    file_id=res.get("files",[{}])[0].get("id") if res.get("files") else None
-    buf=io.BytesIO(); df.to_csv(buf, index=False, encoding="utf-8-sig"); buf.seek(0)
-    media=MediaIoBaseUpload(buf, mimetype="text/csv", resumable=False)
+    return build("drive","v3",credentials=creds, cache_discovery=False)
+
+def drive_q_str(s: str) -> str:
+    # Drive 검색식 문자열 리터럴: \ 와 ' 는 백슬래시로 이스케이프 (URL 인코딩은 googleapiclient가 처리)
+    return "'" + s.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+def drive_list_files(service, folder_id: str, *names: str) -> Dict[str, dict]:
+    """폴더 내 지정 파일들을 list 1회로 조회 → {name: file} (업로드/다운로드가 공유)"""
+    by_name=" or ".join(f"name={drive_q_str(n)}" for n in names)
+    res=service.files().list(q=f"{drive_q_str(folder_id)} in parents and trashed=false and ({by_name})",
+                             fields="files(id,name)", supportsAllDrives=True, includeItemsFromAllDrives=True).execute()
+    found: Dict[str, dict] = {}
+    for f in res.get("files",[]): found.setdefault(f["name"], f)
+    return found
+
+def drive_upload_csv(service, folder_id: str, name: str, local_path: str, files: Dict[str, dict]) -> str:
+    from googleapiclient.http import MediaFileUpload
+    file_id=files[name]["id"] if name in files else None
+    media=MediaFileUpload(local_path, mimetype="text/csv", resumable=False)  # 방금 저장한 로컬 파일을 그대로 업로드
     if file_id:
         service.files().update(fileId=file_id, media_body=media, supportsAllDrives=True).execute(); return file_id
     meta={"name":name,"parents":[folder_id],"mimeType":"text/csv"}
     created=service.files().create(body=meta, media_body=media, fields="id", supportsAllDrives=True).execute()
     return created["id"]
 
-def drive_download_csv(service, folder_id: str, name: str) -> Optional[pd.DataFrame]:
-    from googleapiclient.http import MediaIoBaseDownload
-    res=service.files().list(q=f"name='{name}' and '{folder_id}' in parents and trashed=false",
-                             fields="files(id,name)", supportsAllDrives=True, includeItemsFromAllDrives=True).execute()
-    files=res.get("files",[])
-    if not files: return None
-    fid=files[0]["id"]; req=service.files().get_media(fileId=fid, supportsAllDrives=True)
-    fh=io.BytesIO(); dl=MediaIoBaseDownload(fh, req); done=False
-    while not done: _,done=dl.next_chunk()
-    fh.seek(0); return pd.read_csv(fh)
+PREV_CSV_COLUMNS = ("rank","product_name","url","asin")
+
+def read_prev_csv(src) -> pd.DataFrame:
+    """전일 비교(build_sections)에 쓰는 컬럼만 읽음 (구버전 파일에 없는 컬럼은 그냥 건너뜀)"""
+    return pd.read_csv(src, usecols=lambda c: c in PREV_CSV_COLUMNS)
+
+def drive_download_csv(service, name: str, files: Dict[str, dict]) -> Optional[pd.DataFrame]:
+    if name not in files: return None
+    data=service.files().get_media(fileId=files[name]["id"], supportsAllDrives=True).execute()  # 작은 CSV → 청크 루프 없이 한 번에
+    return read_prev_csv(io.BytesIO(data))
 
 # ==================== Slack ====================
 def slack_post(text: str):
     import requests as _r
     url=os.getenv("SLACK_WEBHOOK_URL")
     if not url: print("[경고] SLACK_WEBHOOK_URL 미설정 → 콘솔 출력\n", text); return
-    r=_r.post(url, json={"text":text}, timeout=20)
+    # 한글/이모지를 \uXXXX로 이스케이프하지 않고 UTF-8 그대로 전송 (대부분 ASCII URL이라 샘플 리포트 기준 약 10% 감소)
+    body=json.dumps({"text":text}, ensure_ascii=False).encode("utf-8")
+    r=_r.post(url, data=body, headers={"Content-Type":"application/json; charset=utf-8"}, timeout=20)
     if r.status_code>=300: print("[Slack 실패]", r.status_code, r.text)
 
+CSV_COLUMNS = ["date","rank","brand","product_name","price","orig_price","discount_percent","url","asin"]
+
 def to_dataframe(products: List[Product], date_str: str) -> pd.DataFrame:
-    cols=["date","rank","brand","product_name","price","orig_price","discount_percent","url","asin"]
-    if not products: return pd.DataFrame(columns=cols)
-    return pd.DataFrame([{
-        "date": date_str, "rank": p.rank, "brand": p.brand, "product_name": p.title,
-        "price": p.price, "orig_price": p.orig_price, "discount_percent": p.discount_percent,
-        "url": p.url, "asin": p.asin,
-    } for p in products], columns=cols)
+    if not products: return pd.DataFrame(columns=CSV_COLUMNS)
+    return pd.DataFrame({
+        "date": [date_str]*len(products),
+        "rank": [p.rank for p in products],
+        "brand": [p.brand for p in products],
+        "product_name": [p.title for p in products],
+        "price": [p.price for p in products],
+        "orig_price": [p.orig_price for p in products],
+        "discount_percent": [p.discount_percent for p in products],
+        "url": [p.url for p in products],
+        "asin": [p.asin for p in products],
+    }, columns=CSV_COLUMNS)
+
+def row_keys(df: pd.DataFrame) -> pd.Series:
+    """상품 키: asin 우선, 비어 있으면 url (numpy 배열 연산)"""
+    def col(name) -> np.ndarray:
+        if name not in df.columns: return np.full(len(df), "", dtype=object)
+        return df[name].fillna("").astype(str).str.strip().to_numpy(dtype=object)
+    asin = col("asin")
+    return pd.Series(np.where(asin != "", asin, col("url")), index=df.index, dtype=object)
 
 def build_sections(df_today: pd.DataFrame, df_prev: Optional[pd.DataFrame]) -> Dict[str, List[str]]:
     """
@@ -662,137 +827,89 @@ def build_sections(df_today: pd.DataFrame, df_prev: Optional[pd.DataFrame]) -> D
     S = {"top10": [], "rising": [], "newcomers": [], "falling": [], "outs": [], "inout_count": 0}
     if df_today is None or "rank" not in df_today.columns or df_today.empty: return S
 
+    # 키는 프레임별로 한 번만 계산하고 부분집합은 index로 재사용
+    today_key = row_keys(df_today)
+    has_prev = df_prev is not None and "rank" in df_prev.columns and len(df_prev) > 0
+    prev_key = row_keys(df_prev) if has_prev else None
+
     # 전일 rank 맵
     prev_rank_map={}
-    if df_prev is not None and "rank" in df_prev.columns and len(df_prev):
-        df_p = df_prev.copy()
-        df_p["key"] = df_p.apply(lambda x: (str(x.get("asin")).strip() or str(x.get("url")).strip()), axis=1)
-        for _, row in df_p[["key","rank"]].dropna().iterrows():
-            try: prev_rank_map[str(row["key"])] = int(row["rank"])
-            except: pass
+    if has_prev:
+        ranked = df_prev["rank"].notna()
+        prev_rank_map = dict(zip(prev_key[ranked], df_prev.loc[ranked, "rank"].astype(int)))
 
     # TOP10
-    top10 = df_today.dropna(subset=["rank"]).sort_values("rank").head(10)
-    for _, r in top10.iterrows():
-        cur_rank = int(r["rank"])
-        key = (str(r.get("asin")).strip() or str(r.get("url")).strip())
+    top10 = df_today.dropna(subset=["rank"]).nsmallest(10, "rank")
+    cols = [top10[c].to_numpy() for c in ("rank","product_name","brand","url","price","discount_percent")]
+    for key, (rank, name, br, url, price, dc) in zip(today_key.loc[top10.index].to_numpy(), zip(*cols)):
+        cur_rank = int(rank)
         prev_rank = prev_rank_map.get(key)
         if prev_rank is None: badge="(new)"
         elif prev_rank > cur_rank: badge=f"(↑{prev_rank-cur_rank})"
         elif prev_rank < cur_rank: badge=f"(↓{cur_rank-prev_rank})"
         else: badge="(-)"
-        name = clean_text(r["product_name"]); br = clean_text(r.get("brand",""))
+        name = clean_text(name); br = clean_text(br)
         name_show = f"{br} {name}" if br and not name.lower().startswith(br.lower()) else name
-        price_txt = fmt_currency_usd(r["price"])
-        dc = r.get("discount_percent"); dc_tail = f" (↓{int(dc)}%)" if pd.notnull(dc) else ""
-        S["top10"].append(f"{cur_rank}. {badge} <{r['url']}|{slack_escape(name_show)}> — {price_txt}{dc_tail}")
-
-    if df_prev is None or not len(df_prev) or "rank" not in df_prev.columns: return S
-
-    df_t = df_today.copy()
-    df_t = df_t[(df_t["rank"].notna()) & (df_t["rank"] <= 100)].copy()
-    df_t["key"] = df_t.apply(lambda x: (str(x.get("asin")).strip() or str(x.get("url")).strip()), axis=1)
-    df_t.set_index("key", inplace=True)
-
-    df_p = df_prev.copy()
-    df_p = df_p[(df_p["rank"].notna()) & (df_p["rank"] <= 100)].copy()
-    df_p["key"] = df_p.apply(lambda x: (str(x.get("asin")).strip() or str(x.get("url")).strip()), axis=1)
-    df_p.set_index("key", inplace=True)
-
-    common_all = set(df_t.index) & set(df_p.index)
-    new_all    = set(df_t.index) - set(df_p.index)
-    out_all    = set(df_p.index) - set(df_t.index)
-
-    # 급상승
-    rising=[]
-    for k in common_all:
-        pr, cr = int(df_p.loc[k,"rank"]), int(df_t.loc[k,"rank"])
-        imp = pr - cr
-        if imp >= 10:
-            nm = slack_escape(clean_text(df_t.loc[k]["product_name"]))
-            rising.append((imp, cr, pr, nm, f"- <{df_t.loc[k]['url']}|{nm}> {pr}위 → {cr}위 (↑{imp})"))
-    rising.sort(key=lambda x: (-x[0], x[1], x[2], x[3]))
-    S["rising"] = [x[-1] for x in rising[:5]]
-
-    # 급하락
-    falling=[]
-    for k in common_all:
-        pr, cr = int(df_p.loc[k,"rank"]), int(df_t.loc[k,"rank"])
-        drop = cr - pr
-        if drop >= 10:
-            nm = slack_escape(clean_text(df_t.loc[k]["product_name"]))
-            falling.append((drop, cr, pr, nm, f"- <{df_t.loc[k]['url']}|{nm}> {pr}위 → {cr}위 (↓{drop})"))
-    falling.sort(key=lambda x: (-x[0], x[1], x[2], x[3]))
-    S["falling"] = [x[-1] for x in falling[:5]]
+        price_txt = fmt_currency_usd(price)
+        dc_tail = f" (↓{int(dc)}%)" if pd.notnull(dc) else ""
+        S["top10"].append(f"{cur_rank}. {badge} <{url}|{slack_escape(name_show)}> — {price_txt}{dc_tail}")
+
+    if not has_prev: return S
+
+    # Top100 행 위치: 프레임 복사/set_index 없이 키 → 행 위치 dict + 컬럼 배열
+    keys_t, keys_p = today_key.to_numpy(), prev_key.to_numpy()
+    rank_t = df_today["rank"].to_numpy(dtype=float, na_value=np.nan)  # NaN은 비교에서 False
+    rank_p = df_prev["rank"].to_numpy(dtype=float, na_value=np.nan)
+    url_t, url_p = df_today["url"].to_numpy(), df_prev["url"].to_numpy()
+    # 표시용 이름은 행 위치에 맞춰 한 번만 정리/escape
+    esc_t = [slack_escape(clean_text(n)) for n in df_today["product_name"].to_numpy()]
+    esc_p = [slack_escape(clean_text(str(n))) for n in df_prev["product_name"].to_numpy()]
+    pos_t = {keys_t[i]: i for i in np.flatnonzero(rank_t <= 100)}
+    pos_p = {keys_p[i]: i for i in np.flatnonzero(rank_p <= 100)}
+
+    # 급상승/급하락: 공통 키의 행 위치로 벡터 연산 (lexsort는 안정 정렬 → 동률은 오늘 순서)
+    common = [k for k in pos_t if k in pos_p]
+    it = np.array([pos_t[k] for k in common], dtype=int)
+    ip = np.array([pos_p[k] for k in common], dtype=int)
+    rt = rank_t[it].astype(int); rp = rank_p[ip].astype(int); delta = rp - rt
+
+    up = np.flatnonzero(delta >= 10)
+    up = up[np.lexsort((rp[up], rt[up], -delta[up]))][:5]
+    S["rising"] = [
+        f"- <{url_t[it[j]]}|{esc_t[it[j]]}> {rp[j]}위 → {rt[j]}위 (↑{delta[j]})"
+        for j in up
+    ]
+
+    down = np.flatnonzero(delta <= -10)
+    down = down[np.lexsort((rp[down], rt[down], delta[down]))][:5]
+    S["falling"] = [
+        f"- <{url_t[it[j]]}|{esc_t[it[j]]}> {rp[j]}위 → {rt[j]}위 (↓{-delta[j]})"
+        for j in down
+    ]
 
     # 뉴랭커 (30위 이내)
-    t30 = df_t[df_t["rank"] <= 30].copy()
-    p30 = df_p[df_p["rank"] <= 30].copy()
+    p30 = set(keys_p[rank_p <= 30])
     newcomers=[]
-    for k in (set(t30.index) - set(p30.index)):
-        cr = int(t30.loc[k,"rank"])
-        nm = slack_escape(clean_text(t30.loc[k]["product_name"]))
-        newcomers.append((cr, f"- <{t30.loc[k]['url']}|{nm}> NEW → {cr}위"))
-    newcomers.sort(key=lambda x: x[0])
-    S["newcomers"] = [x[1] for x in newcomers[:3]]
+    for i in np.flatnonzero(rank_t <= 30):
+        if keys_t[i] in p30: continue
+        cr = int(rank_t[i])
+        newcomers.append((cr, f"- <{url_t[i]}|{esc_t[i]}> NEW → {cr}위"))
+    S["newcomers"] = [x[1] for x in heapq.nsmallest(3, newcomers, key=itemgetter(0))]
 
     # OUT (전일 1~70 → OUT)
-    # k(ASIN 또는 URL) → rank 매핑 (안전용 폴백)
-    if "asin" in df_prev.columns:
-        prev_rank_map = pd.Series(
-            df_prev["rank"].values,
-            index=df_prev["asin"].astype(str).str.strip()
-        ).to_dict()
-    else:
-        prev_rank_map = pd.Series(
-            df_prev["rank"].values,
-            index=df_prev["url"].astype(str).str.strip()
-        ).to_dict()
-
     outs = []
-    for k in out_all:
-        ks = str(k).strip()
-
-        # 전일 rank (df_p에 있으면 우선 사용, 없으면 폴백 맵)
-        if ks in df_p.index:
-            try:
-                pr = int(df_p.at[ks, "rank"])
-            except Exception:
-                pr = int(prev_rank_map.get(ks, 9999))
-        else:
-            pr = int(prev_rank_map.get(ks, 9999))
-
+    for k, i in pos_p.items():
+        if k in pos_t: continue
+        pr = int(rank_p[i])
         if pr <= 70:
-            # 전일 상품명/URL
-            if ks in df_p.index:
-                nm  = slack_escape(clean_text(str(df_p.at[ks, "product_name"])))
-                url = str(df_p.at[ks, "url"])
-            else:
-                nm, url = "", ""
-
-            outs.append((pr, f"<{url}|{nm}> {pr}위 → OUT"))
-
-    outs.sort(key=lambda x: x[0])
-    S["outs"] = [x[1] for x in outs[:5]]
-
-    # 인&아웃 수 = Top100 교체 수(대칭차집합/2)
-    if "asin" in df_today.columns and "asin" in df_prev.columns:
-        today_keys = set(
-            df_today.sort_values("rank").head(100)["asin"].astype(str).str.strip()
-        )
-        prev_keys = set(
-            df_prev[df_prev["rank"].between(1, 100)]["asin"].astype(str).str.strip()
-        )
-    else:
-        # asin이 없으면 URL로 폴백
-        today_keys = set(
-            df_today.sort_values("rank").head(100)["url"].astype(str).str.strip()
-        )
-        prev_keys = set(
-            df_prev[df_prev["rank"].between(1, 100)]["url"].astype(str).str.strip()
-        )
-
-    S["inout_count"] = len(today_keys ^ prev_keys) // 2
+            outs.append((pr, f"<{url_p[i]}|{esc_p[i]}> {pr}위 → OUT"))
+    S["outs"] = [x[1] for x in heapq.nsmallest(5, outs, key=itemgetter(0))]
+
+    # 인&아웃 수 = Top100 교체 수(대칭차집합/2), asin이 없으면 URL로 폴백
+    kc = "asin" if ("asin" in df_today.columns and "asin" in df_prev.columns) else "url"
+    today_keys = df_today.nsmallest(100, "rank")[kc].astype(str).str.strip().to_numpy(dtype=str)
+    prev_keys = df_prev.loc[df_prev["rank"].between(1, 100), kc].astype(str).str.strip().to_numpy(dtype=str)
+    S["inout_count"] = int(np.setxor1d(today_keys, prev_keys).size) // 2
     return S
 
 def build_slack_message(date_str: str, S: Dict[str, List[str]], total_count: int) -> str:
@@ -819,16 +936,18 @@ def main():
     print("수집 완료:", len(items))
 
     df_today=to_dataframe(items, date_str)
+    local_path=os.path.join("data", file_today)  # 한 번 직렬화해서 로컬 저장 → Drive는 이 파일을 업로드
     os.makedirs("data", exist_ok=True)
-    df_today.to_csv(os.path.join("data", file_today), index=False, encoding="utf-8-sig")
+    df_today.to_csv(local_path, index=False, encoding="utf-8-sig")
     print("로컬 저장:", file_today)
 
     folder=normalize_folder_id(os.getenv("GDRIVE_FOLDER_ID","")); df_prev=None
     if folder:
         try:
             svc=build_drive_service()
-            drive_upload_csv(svc, folder, file_today, df_today); print("Google Drive 업로드 완료:", file_today)
-            df_prev=drive_download_csv(svc, folder, file_yest); print("전일 CSV", "성공" if df_prev is not None else "미발견")
+            files=drive_list_files(svc, folder, file_today, file_yest)
+            drive_upload_csv(svc, folder, file_today, local_path, files); print("Google Drive 업로드 완료:", file_today)
+            df_prev=drive_download_csv(svc, file_yest, files); print("전일 CSV", "성공" if df_prev is not None else "미발견")
         except Exception as e:
             print("Google Drive 처리 오류:", e); traceback.print_exc()
 